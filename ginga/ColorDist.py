@@ -19,6 +19,10 @@ class ColorDistError(Exception):
 
 class ColorDistBase(object):
 
+    # True if the hash table is computed from the data on each call of
+    # hash_array(), rather than once by calc_hash()
+    data_dependent = False
+
     def __init__(self, hashsize, colorlen=None):
         super(ColorDistBase, self).__init__()
 
@@ -34,7 +38,11 @@ class ColorDistBase(object):
     def hash_array(self, idx):
         # NOTE: data could be assumed to be in the range 0..hashsize-1
         # at this point but clip as a precaution
-        idx = idx.clip(0, self.hashsize - 1).astype(np.uint, copy=False)
+        idx = idx.clip(0, self.hashsize - 1)
+        if idx.dtype.kind != 'u':
+            # NOTE: hash sizes are limited to maxhashsize, so 32 bits is
+            # plenty and unsigned inputs need not be widened
+            idx = idx.astype(np.uint32)
         arr = self.hash[idx]
         return arr
 
@@ -294,6 +302,7 @@ class HistogramEqualizationDist(ColorDistBase):
     The histogram equalization distribution function distributes colors
     based on the frequency of each data value.
     """
+    data_dependent = True
 
     def __init__(self, hashsize, colorlen=None):
         super(HistogramEqualizationDist, self).__init__(hashsize,
@@ -90,6 +90,12 @@ class RGBMapper(Callback.Callbacks):
         self.logger = logger
         self.mapper_id = str(uuid.uuid4())
         self.cache_arr = None
+        # combined hash + cache lookup table, see get_rgb_lut()
+        self._lut = None
+        self._lut_src = (None, None)
+        # packed RGBA version of the above, see _get_packed_lut()
+        self._packed_lut = None
+        self._packed_lut_src = (None, None)
 
         # For color and intensity maps
         self.cmap = None
@@ -406,14 +412,83 @@ class RGBMapper(Callback.Callbacks):
         cs = cs.upper()
         return [order.index(c) for c in cs]
 
+    def get_rgb_lut(self):
+        """Returns a lookup table that maps values in the range of the
+        color distribution hash directly to RGB values.
+
+        This combines the color distribution hash and the cache array
+        so that colorizing an index array needs only a single lookup.
+        The table is rebuilt only when either of them changes.
+
+        Returns
+        -------
+        lut : ndarray or None
+            A (hash size, 3) array of RGB values, or None if this mapper
+            has no cache array or its color distribution depends on the
+            data (e.g. histogram equalization)
+        """
+        if self.cache_arr is None:
+            return None
+
+        hash_arr = None
+        if not self.p_dist._bypass:
+            dist = self.p_dist.get_dist()
+            if dist.data_dependent:
+                # hash is rebuilt from each array, so it can't be folded in
+                return None
+            hash_arr = dist.hash
+        cache_arr, _hash_arr = self._lut_src
+        if (self._lut is None or cache_arr is not self.cache_arr or
+            _hash_arr is not hash_arr):
+            if hash_arr is None:
+                self._lut = self.cache_arr
+            else:
+                self._lut = self.cache_arr[hash_arr]
+            self._lut_src = (self.cache_arr, hash_arr)
+        return self._lut
+
+    def _get_packed_lut(self, lut, order):
+        """Returns `lut` packed as 32-bit RGBA values laid out
+        according to `order`, so that a single gather yields 8 bpp RGBA
+        pixels.
+        """
+        _lut, _order = self._packed_lut_src
+        if self._packed_lut is None or _lut is not lut or _order != order:
+            rgba = np.empty((len(lut), 4), dtype=np.uint8)
+            ri, gi, bi, ai = self.get_order_indexes(order, 'RGBA')
+            rgba[:, [ri, gi, bi]] = lut
+            rgba[:, ai] = self.maxc
+            self._packed_lut = rgba.view(np.uint32).ravel()
+            self._packed_lut_src = (lut, order)
+        return self._packed_lut
+
     def get_rgb_array(self, idx, order=None):
 
+        state = self.pipeline.get('state')
         if self.cache_arr is not None:
             # if the cache array is set, then this will deliver a faster
-            # short cut to the colorized output--just apply the color
-            # distribution and then map through the cache array
-            idx = self.p_dist.get_hasharray(idx)
-            arr_out = self.p_cmap.do_map_index(idx, self.cache_arr)
+            # short cut to the colorized output--just map through the
+            # combined color distribution and cache array
+            lut = self.get_rgb_lut()
+            if lut is None:
+                # distribution depends on the data: apply it first and
+                # then map through the cache array
+                idx = self.p_dist.get_hasharray(idx)
+                lut = self.cache_arr
+            if (len(idx.shape) == 2 and self.p_cmap.dtype == np.uint8 and
+                len(state.order) == 4 and 'A' in state.order):
+                # common case of 8 bpp RGBA output: use a single gather
+                # from a packed table (mode='clip' also clips the indexes)
+                packed = self._get_packed_lut(lut, state.order)
+                if not np.can_cast(idx.dtype, np.intp):
+                    # e.g. float or uint64 indexes, which np.take() won't
+                    # accept; clip first so that the cast is safe
+                    idx = idx.clip(0, len(packed) - 1).astype(np.uint32)
+                arr_out = np.take(packed, idx, mode='clip')
+                arr_out = arr_out.view(np.uint8).reshape(idx.shape + (4,))
+            else:
+                idx = idx.clip(0, len(lut) - 1)
+                arr_out = self.p_cmap.do_map_index(idx, lut)
 
         else:
             # else run through the pipeline as usual
@@ -423,7 +498,6 @@ class RGBMapper(Callback.Callbacks):
             arr_out = self.pipeline.get_data(self.pipeline[-1])
 
         # reorder as caller needs it
-        state = self.pipeline.get('state')
         if order is not None and order != state.order:
             arr_out = trcalc.reorder_image(order, arr_out, state.order)
 
@@ -564,8 +638,8 @@ class RGBInput(RGBMapStage):
         self.in_arr = None
 
     def set_input(self, in_arr):
-        if not np.issubdtype(in_arr.dtype, np.uint):
-            in_arr = in_arr.astype(np.uint)
+        if in_arr.dtype.kind != 'u':
+            in_arr = in_arr.astype(np.uint32)
 
         #self.verify_2d(in_arr)
 
@@ -621,8 +695,8 @@ class Distribute(RGBMapStage):
         if self._bypass or arr_in is None:
             return arr_in
 
-        if not np.issubdtype(arr_in.dtype, np.uint):
-            arr_in = arr_in.astype(np.uint)
+        if arr_in.dtype.kind != 'u':
+            arr_in = arr_in.astype(np.uint32)
 
         return self.dist.hash_array(arr_in)
 
@@ -802,8 +876,8 @@ class ShiftMap(RGBMapStage):
             return
         #self.verify_2d(arr_in)
 
-        if not np.issubdtype(arr_in.dtype, np.uint):
-            arr_in = arr_in.astype(np.uint)
+        if arr_in.dtype.kind != 'u':
+            arr_in = arr_in.astype(np.uint32)
 
         # run it through the shift array and clip the result
         # See NOTE [A]
@@ -851,8 +925,8 @@ class IntensityMap(RGBMapStage):
             return
         #self.verify_2d(arr_in)
 
-        if not np.issubdtype(arr_in.dtype, np.uint):
-            arr_in = arr_in.astype(np.uint)
+        if arr_in.dtype.kind != 'u':
+            arr_in = arr_in.astype(np.uint32)
 
         arr_out = self._iarr[arr_in]
 
@@ -933,8 +1007,8 @@ class ColorMap(RGBMapStage):
         return [order.index(c) for c in cs]
 
     def do_map_index(self, arr_in, map_arr):
-        if not np.issubdtype(arr_in.dtype, np.uint):
-            arr_in = arr_in.astype(np.uint)
+        if arr_in.dtype.kind != 'u':
+            arr_in = arr_in.astype(np.uint32)
 
         # prepare output array
         shape = arr_in.shape
@@ -322,7 +322,8 @@ class StandardPipelineRenderer(RendererBase):
                                  org_pan=(0.0, 0.0, 0.0),
                                  ctr=(0, 0),
                                  win_dim=(0, 0),
-                                 order=self.std_order)
+                                 order=self.std_order,
+                                 a_idx=self.std_order.find('A'))
         self.pipeline.set(state=self.state)
         # initialize pipeline
         self.pipeline.invalidate()
@@ -386,7 +387,11 @@ class StandardPipelineRenderer(RendererBase):
 
         # reorder as caller needs it
         outarr = self.reorder(dst_order, outarr, src_order=src_order)
-        outarr = np.ascontiguousarray(outarr)
+        if outarr is self.pipeline.get_data(last_stage):
+            # don't hand out the pipeline's reusable output buffer
+            outarr = np.copy(outarr, order='C')
+        else:
+            outarr = np.ascontiguousarray(outarr)
         if dtype is not None:
             outarr = outarr.astype(dtype, copy=False)
         return outarr
@@ -419,7 +424,8 @@ class StandardPipelineRenderer(RendererBase):
         wd, ht = dims[:2]
         ctr = (wd // 2, ht // 2)
         self.state.setvals(win_dim=dims[:2], ctr=ctr,
-                           order=self.std_order)
+                           order=self.std_order,
+                           a_idx=self.std_order.find('A'))
 
         # update pan and scale values in pipeline
         pan_x, pan_y = self.viewer.get_pan(coord='data')[:2]
@@ -461,6 +461,13 @@ class ComboBox(WidgetBase):
         idx = len(model)
         model.insert(idx, tup)
 
+    def append_texts(self, texts):
+        # NOTE: the model is not detached while filling it, because that
+        # would clear the active item and fire our 'activated' callback
+        model = self.widget.get_model()
+        for text in texts:
+            model.append((text, ))
+
     def insert_text(self, idx, text):
         model = self.widget.get_model()
         tup = (text, )
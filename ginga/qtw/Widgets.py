@@ -433,6 +433,9 @@ class ComboBox(WidgetBase):
     def append_text(self, text):
         self.widget.addItem(text)
 
+    def append_texts(self, texts):
+        self.widget.addItems(list(texts))
+
     def set_index(self, index):
         self.widget.blockSignals(True)
         self.widget.setCurrentIndex(index)
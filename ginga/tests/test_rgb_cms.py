@@ -0,0 +1,27 @@
+"""Unit Tests for the rgb_cms.py functions"""
+
+from ginga.misc import Bunch
+from ginga.util import rgb_cms
+
+
+class TestRgbCms(object):
+
+    def test_is_same_profile(self):
+        assert rgb_cms.is_same_profile('test-a', 'test-a')
+        # unknown profiles are only the same as themselves
+        assert not rgb_cms.is_same_profile('test-a', 'test-b')
+
+        rgb_cms.profile_dict['test-a'] = Bunch.Bunch(name='test-a',
+                                                     path='test-a.icc')
+        rgb_cms.profile_dict['test-c'] = Bunch.Bunch(name='test-c',
+                                                     path='test-c.icc')
+        try:
+            rgb_cms.set_profile_alias('test-b', 'test-a')
+
+            assert rgb_cms.is_same_profile('test-a', 'test-b')
+            assert rgb_cms.is_same_profile('test-b', 'test-a')
+            assert not rgb_cms.is_same_profile('test-a', 'test-c')
+            assert not rgb_cms.is_same_profile('test-b', 'test-c')
+        finally:
+            for name in ('test-a', 'test-b', 'test-c'):
+                rgb_cms.profile_dict.pop(name, None)
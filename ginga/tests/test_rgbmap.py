@@ -0,0 +1,79 @@
+"""Unit Tests for the RGBMap.py functions"""
+
+import numpy as np
+import pytest
+
+from ginga import ColorDist
+from ginga.misc import log
+from ginga.RGBMap import RGBMapper
+
+
+class TestRGBMapper(object):
+
+    def setup_class(self):
+        self.logger = log.get_logger("TestRGBMapper", null=True)
+
+    def make_rgbmap(self):
+        rgbmap = RGBMapper(self.logger)
+        rgbmap.set_color_map('rainbow3')
+        return rgbmap
+
+    def expected_rgb(self, rgbmap, idx):
+        lut = rgbmap.get_rgb_lut()
+        idx = np.clip(idx, 0, len(lut) - 1).astype(int)
+        return lut[idx]
+
+    @pytest.mark.parametrize(
+        'dtype', [np.uint8, np.uint16, np.uint32, np.uint64, int, float])
+    @pytest.mark.parametrize('order', ['RGBA', 'RGB'])
+    def test_get_rgb_array_index_types(self, dtype, order):
+        rgbmap = self.make_rgbmap()
+        vals = np.arange(0, 256).reshape((16, 16))
+        if np.dtype(dtype).kind != 'u':
+            # out of range values should be clipped
+            vals[0, :4] = [-5, -1, 256, 1000]
+        idx = vals.astype(dtype)
+
+        res = rgbmap.get_rgb_array(idx, order=order)
+
+        assert res.shape == idx.shape + (len(order),)
+        assert res.dtype == np.uint8
+        np.testing.assert_array_equal(res[..., :3],
+                                      self.expected_rgb(rgbmap, vals))
+        if order == 'RGBA':
+            assert np.all(res[..., 3] == 255)
+
+    @pytest.mark.parametrize('dist_name', ColorDist.get_dist_names())
+    def test_get_rgb_array_dist(self, dist_name):
+        rgbmap = self.make_rgbmap()
+        rgbmap.set_color_algorithm(dist_name)
+        # skewed histogram, so that histogram equalization matters
+        data1 = np.concatenate((np.zeros(1000), np.full(10, 200)))
+        data1 = data1.astype(np.uint8).reshape((10, 101))
+        data2 = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+
+        # map two different arrays in turn, to make sure that nothing
+        # computed from the first one is used for the second
+        for data in (data1, data2, data1):
+            res = rgbmap.get_rgb_array(data, order='RGB')
+
+            # map through the distribution and then the cache array
+            hash_arr = rgbmap.p_dist.get_hasharray(data)
+            expected = rgbmap.cache_arr[hash_arr]
+            np.testing.assert_array_equal(res, expected)
+
+    @pytest.mark.parametrize('dist_name', ColorDist.get_dist_names())
+    def test_get_rgb_lut(self, dist_name):
+        rgbmap = self.make_rgbmap()
+        rgbmap.set_color_algorithm(dist_name)
+        dist = rgbmap.get_dist()
+
+        lut = rgbmap.get_rgb_lut()
+        if dist.data_dependent:
+            assert lut is None
+        else:
+            np.testing.assert_array_equal(lut, rgbmap.cache_arr[dist.hash])
+            # table is reused until the mapping changes
+            assert rgbmap.get_rgb_lut() is lut
+            rgbmap.set_color_map('gray')
+            assert rgbmap.get_rgb_lut() is not lut
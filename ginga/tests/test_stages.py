@@ -0,0 +1,423 @@
+"""Unit Tests for the pipeline stages in ginga.util.stages"""
+
+import logging
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from ginga import trcalc
+from ginga.misc import log, Bunch
+from ginga.RGBMap import RGBMapper
+from ginga.util.pipeline import Pipeline
+from ginga.util.stages import render, rgbmap as rgbmap_stage
+from ginga.util.stages.base import Stage
+from ginga.util.stages.rgbmap import RGBMap
+
+
+class Source(Stage):
+    """Stage that sends a fixed array."""
+
+    _stagename = 'test-source'
+
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+
+    def run(self, prev_stage):
+        self.pipeline.send(res_np=self.data)
+
+
+class GuiDo(object):
+    """Stands in for the reference viewer's gui_do_oneshot()."""
+
+    def __init__(self):
+        self.calls = []
+
+    def gui_do_oneshot(self, catname, method, *args, **kwargs):
+        self.calls.append((catname, method, args, kwargs))
+
+
+class TestRGBMapStage(object):
+
+    def setup_class(self):
+        self.logger = log.get_logger("TestRGBMapStage", null=True)
+
+    def make_pipeline(self, data):
+        src = Source(data)
+        stage = RGBMap()
+        # normally done in build_gui()
+        stage.fv = GuiDo()
+        stage.rgbmap = RGBMapper(self.logger)
+        stage.rgbmap.set_color_map('rainbow3')
+        stage.rgbmap.add_callback('changed', stage.rgbmap_changed_cb)
+        pipe = Pipeline(self.logger, [src, stage])
+        return pipe, src, stage
+
+    def expected(self, stage, data):
+        return stage.rgbmap.get_rgb_array(data, order='RGB')
+
+    def test_run(self):
+        data = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+
+        pipe.run_all()
+
+        res = pipe.get_data(stage)
+        assert res.shape == data.shape + (3,)
+        np.testing.assert_array_equal(res, self.expected(stage, data))
+
+    @pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.uint64])
+    def test_run_dtypes(self, dtype):
+        data = (np.arange(0, 1000) % 256).astype(dtype).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+
+        pipe.run_all()
+
+        np.testing.assert_array_equal(pipe.get_data(stage),
+                                      self.expected(stage, data))
+
+    @pytest.mark.parametrize('dtype', [np.uint8, np.uint64])
+    def test_run_rgb_indexes(self, dtype):
+        # indexes that already contain RGB info
+        data = (np.arange(0, 3000) % 256).astype(dtype).reshape((20, 50, 3))
+        pipe, src, stage = self.make_pipeline(data)
+
+        pipe.run_all()
+
+        lut = stage.rgbmap.get_rgb_lut()
+        expected = np.dstack([lut[data[..., i].astype(int), i]
+                              for i in range(3)])
+        np.testing.assert_array_equal(pipe.get_data(stage), expected)
+
+    def test_run_result_not_reused(self):
+        # later stages (e.g. the preview) may keep our result, so a later
+        # run must not write over it
+        data = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+        pipe.run_all()
+        res1 = pipe.get_data(stage)
+        expected1 = res1.copy()
+
+        src.data = 255 - data
+        pipe.run_all()
+
+        res2 = pipe.get_data(stage)
+        np.testing.assert_array_equal(res1, expected1)
+        np.testing.assert_array_equal(res2, self.expected(stage, src.data))
+
+    @pytest.mark.parametrize('dtype', [np.int32, np.int64, float])
+    def test_run_out_of_range(self, dtype):
+        data = (np.arange(0, 1000) % 256).astype(dtype).reshape((20, 50))
+        # values outside of the color hash table must be clipped to its
+        # ends, not wrapped around
+        data[0, :6] = [-1, -65536, -70000, 256, 65546, 10 ** 6]
+        pipe, src, stage = self.make_pipeline(data)
+
+        pipe.run_all()
+
+        np.testing.assert_array_equal(pipe.get_data(stage),
+                                      self.expected(stage, data))
+        lut = stage.rgbmap.get_rgb_lut()
+        np.testing.assert_array_equal(pipe.get_data(stage)[0, :6],
+                                      lut[[0, 0, 0, -1, -1, -1]])
+
+    def test_run_input_changed_in_place(self):
+        data = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+        pipe.run_all()
+
+        # rerunning from the source with the same array, after changing
+        # its contents, must not send the previous result
+        data[:10] = 255 - data[:10]
+        pipe.run_all()
+
+        np.testing.assert_array_equal(pipe.get_data(stage),
+                                      self.expected(stage, data))
+
+    def test_run_from_stage_reuses_result(self):
+        data = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+        pipe.run_all()
+        res = pipe.get_data(stage)
+
+        # nothing changed, so the previous result is sent again
+        pipe.run_from(stage)
+        assert pipe.get_data(stage) is res
+
+        # a mapping change is picked up
+        stage.rgbmap.set_color_map('gray')
+        pipe.run_from(stage)
+        np.testing.assert_array_equal(pipe.get_data(stage),
+                                      self.expected(stage, data))
+
+    def test_get_output_signature(self):
+        data = np.zeros((4, 5), dtype=np.uint8)
+        pipe, src, stage = self.make_pipeline(data)
+
+        sig = stage.get_output_signature(data)
+        assert sig == stage.get_output_signature(data)
+        hash(sig)
+
+        # different input array
+        assert sig != stage.get_output_signature(data.copy())
+        # changed mapping
+        stage.rgbmap.set_color_map('gray')
+        assert sig != stage.get_output_signature(data)
+
+    def test_slider_changes_coalesced(self):
+        data = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+        stage.gui_up = True
+        pipe.run_all()
+        res = pipe.get_data(stage).copy()
+
+        # several slider movements before the GUI gets around to the
+        # scheduled flush
+        stage.contrast_set_cb(None, 60)
+        stage.contrast_set_cb(None, 70)
+        stage.brightness_set_cb(None, 40)
+
+        assert len(pipe.actions._undo) == 0
+        np.testing.assert_array_equal(pipe.get_data(stage), res)
+        flushes = [call for call in stage.fv.calls
+                   if call[1] == stage._flush_pending]
+        assert len(flushes) == 3
+        # all scheduled under the same oneshot category
+        assert len(set([call[0] for call in flushes])) == 1
+
+        stage._flush_pending()
+
+        # one undoable action, from the values before the first change
+        assert len(pipe.actions._undo) == 1
+        act = pipe.actions._undo[-1]
+        assert act.old == dict(contrast=0.5, brightness=0.5)
+        assert act.new == dict(contrast=0.7, brightness=0.4)
+        # and the pipeline was run with the new settings
+        settings = stage.rgbmap.get_settings()
+        assert settings['contrast'] == 0.7
+        assert settings['brightness'] == 0.4
+        np.testing.assert_array_equal(pipe.get_data(stage),
+                                      self.expected(stage, data))
+        assert not np.array_equal(pipe.get_data(stage), res)
+
+        # nothing left to flush
+        stage._flush_pending()
+        assert len(pipe.actions._undo) == 1
+
+    def test_no_rerun_when_bypassed(self, monkeypatch):
+        data = (np.arange(0, 1000) % 256).astype(np.uint8).reshape((20, 50))
+        pipe, src, stage = self.make_pipeline(data)
+        pipe.run_all()
+        runs = []
+        monkeypatch.setattr(pipe, 'run_from', runs.append)
+
+        stage.bypass(True)
+        stage.set_cmap_cb(None, stage.cmap_names.index('gray'))
+        stage.set_default_distmaps()
+        stage.contrast_set_cb(None, 60)
+        stage._flush_pending()
+
+        # settings changes are still recorded, but the output can't change
+        assert stage.cmap_name == 'gray'
+        assert len(pipe.actions._undo) == 3
+        assert runs == []
+
+        stage.bypass(False)
+        stage.set_cmap_cb(None, stage.cmap_names.index('rainbow3'))
+        assert runs == [stage]
+
+    def test_apply_lut_rgb(self):
+        apply_lut = rgbmap_stage._get_lut_kernel()
+        if apply_lut is None:
+            pytest.skip("numba not installed")
+        rgbmap = RGBMapper(self.logger)
+        rgbmap.set_color_map('rainbow3')
+        lut = rgbmap.get_rgb_lut()
+        for dtype in (np.uint8, np.uint16):
+            # includes indexes past the end of the table, to be clipped
+            data = (np.arange(0, 1000) % 300).astype(dtype).reshape((20, 50))
+            out = np.zeros(data.shape + (3,), dtype=lut.dtype)
+
+            apply_lut(data, lut, out)
+
+            np.testing.assert_array_equal(out, np.take(lut, data, axis=0,
+                                                       mode='clip'))
+
+    def test_unknown_names_fall_back_to_defaults(self, caplog):
+        stage = RGBMap()
+        stage.logger = logging.getLogger("TestRGBMapStage")
+
+        with caplog.at_level(logging.WARNING):
+            stage.import_from_dict(dict(name='rgbmap', bypass=False,
+                                        calg_name='nosuchdist',
+                                        cmap_name='nosuchcmap',
+                                        imap_name='nosuchimap'))
+
+        assert stage.calg_name == 'linear'
+        assert stage.cmap_name == 'gray'
+        assert stage.imap_name == 'ramp'
+        for name in ('nosuchdist', 'nosuchcmap', 'nosuchimap'):
+            assert name in caplog.text
+
+
+class TestStageBuffer(object):
+
+    def test_get_buf(self):
+        stage = Stage()
+
+        buf = stage._get_buf((10, 20, 3), np.uint8)
+        assert buf.shape == (10, 20, 3)
+        assert buf.dtype == np.uint8
+        # same shape and type: same buffer
+        assert stage._get_buf((10, 20, 3), np.uint8) is buf
+
+        # different shape or type: new buffer
+        buf2 = stage._get_buf((10, 21, 3), np.uint8)
+        assert buf2 is not buf
+        assert buf2.shape == (10, 21, 3)
+        buf3 = stage._get_buf((10, 21, 3), np.uint16)
+        assert buf3 is not buf2
+        assert buf3.dtype == np.uint16
+
+
+class BgViewer(object):
+    """Stands in for the viewer, as far as CreateBg is concerned."""
+
+    def __init__(self, bg):
+        self.bg = bg
+
+    def get_bg(self):
+        return self.bg
+
+
+class TestCreateBg(object):
+
+    def setup_class(self):
+        self.logger = log.get_logger("TestCreateBg", null=True)
+
+    def make_pipeline(self, bg=(1.0, 0.5, 0.0)):
+        viewer = BgViewer(bg)
+        stage = render.CreateBg(viewer)
+        pipe = Pipeline(self.logger, [stage])
+        return pipe, stage, viewer
+
+    def run(self, pipe, stage, win_dim):
+        pipe.set(state=Bunch.Bunch(win_dim=win_dim, order='RGBA'))
+        pipe.run_all()
+        return pipe.get_data(stage)
+
+    def test_run(self):
+        pipe, stage, viewer = self.make_pipeline()
+
+        res = self.run(pipe, stage, (30, 40))
+
+        # square, with room to rotate
+        assert res.shape == (70, 70, 4)
+        assert np.all(res == np.array([255, 127, 0, 255], dtype=np.uint8))
+        # shared between runs, so must not be written to
+        assert not res.flags.writeable
+
+    def test_cache(self):
+        pipe, stage, viewer = self.make_pipeline()
+
+        res1 = self.run(pipe, stage, (30, 40))
+        assert self.run(pipe, stage, (30, 40)) is res1
+        # resizing back and forth reuses the arrays
+        res2 = self.run(pipe, stage, (100, 80))
+        assert res2 is not res1
+        assert self.run(pipe, stage, (30, 40)) is res1
+        assert self.run(pipe, stage, (100, 80)) is res2
+
+        # a third size evicts the oldest entry
+        self.run(pipe, stage, (200, 200))
+        assert self.run(pipe, stage, (30, 40)) is not res1
+
+        # changing the background color makes a new array
+        res3 = self.run(pipe, stage, (30, 40))
+        viewer.bg = (0.0, 0.0, 1.0)
+        res4 = self.run(pipe, stage, (30, 40))
+        assert res4 is not res3
+        assert np.all(res4 == np.array([0, 0, 255, 255], dtype=np.uint8))
+
+        stage.invalidate()
+        assert self.run(pipe, stage, (30, 40)) is not res4
+
+
+class OutputRenderer(object):
+
+    def __init__(self, order):
+        self.order = order
+
+    def get_rgb_order(self):
+        return self.order
+
+
+class OutputViewer(object):
+    """Stands in for the viewer, as far as Output is concerned."""
+
+    def __init__(self, order):
+        self.renderer = OutputRenderer(order)
+
+
+class TestOutput(object):
+
+    def setup_class(self):
+        self.logger = log.get_logger("TestOutput", null=True)
+
+    @pytest.mark.parametrize('dst_order', ['RGBA', 'BGRA', 'ARGB',
+                                           'RGB', 'BGR'])
+    def test_run(self, dst_order):
+        data = (np.arange(30 * 40 * 4) % 256).astype(np.uint8)
+        data = data.reshape((30, 40, 4))
+        src = Source(data)
+        stage = render.Output(OutputViewer(dst_order))
+        pipe = Pipeline(self.logger, [src, stage])
+        pipe.set(state=Bunch.Bunch(win_dim=(25, 20), order='RGBA'),
+                 dst=(-3, -5))
+
+        pipe.run_all()
+
+        res = pipe.get_data(stage)
+        expected = trcalc.reorder_image(dst_order, data[5:25, 3:28], 'RGBA')
+        assert pipe.get('out_order') == dst_order
+        np.testing.assert_array_equal(res, expected)
+
+        # the output buffer is reused for the next frame
+        src.data = 255 - data
+        pipe.run_all()
+        expected = trcalc.reorder_image(dst_order, src.data[5:25, 3:28],
+                                        'RGBA')
+        np.testing.assert_array_equal(pipe.get_data(stage), expected)
+
+
+class TestMergeComposite(object):
+
+    @pytest.mark.parametrize('pos', [(5, 7), (-4, -3), (30, 20), (50, 50)])
+    def test_merge_rgb_alpha(self, pos):
+        if render._get_composite_kernel() is None:
+            pytest.skip("numba not installed")
+        rng = np.random.default_rng(42)
+        dstarr = rng.integers(0, 256, (40, 60, 4), dtype=np.uint8)
+        dstarr[..., 3] = 255
+        rgbarr = rng.integers(0, 256, (25, 35, 3), dtype=np.uint8)
+        alpha = rng.integers(0, 256, (25, 35), dtype=np.uint8)
+
+        # composite the same way as Merge does without numba
+        expected = dstarr.copy()
+        rgba = np.dstack((rgbarr, alpha))
+        trcalc.overlay_image(expected, pos, rgba, dst_order='RGBA',
+                             src_order='RGBA', fill=True, flipy=False)
+
+        render._merge_rgb_alpha(dstarr, pos, rgbarr, alpha)
+
+        np.testing.assert_array_equal(dstarr, expected)
+
+    def test_numba_imported_lazily(self):
+        # importing the module must not pay for importing numba
+        code = ("import sys; import ginga.util.stages.render; "
+                "import ginga.util.stages.rgbmap; "
+                "print('numba' in sys.modules)")
+        out = subprocess.check_output([sys.executable, '-c', code])
+        assert out.strip() == b'False'
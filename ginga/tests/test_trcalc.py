@@ -1,5 +1,6 @@
 
 import numpy as np
+import pytest
 
 from ginga import trcalc
 
@@ -21,6 +22,33 @@ class TestTrcalc:
                     data[i, j, k] = min(i, j, k)
         return data
 
+    def _rotate_clip_nearest(self, data, theta_deg):
+        # straightforward nearest neighbor rotation about the center,
+        # with indexes clamped to the edges of the array
+        ht, wd = data.shape[:2]
+        ctr_x, ctr_y = wd // 2, ht // 2
+        yi, xi = np.mgrid[0:ht, 0:wd]
+        xi = xi - ctr_x
+        yi = yi - ctr_y
+        cos_t = np.cos(np.radians(theta_deg))
+        sin_t = np.sin(np.radians(theta_deg))
+        ap = (xi * cos_t) - (yi * sin_t) + ctr_x
+        bp = (xi * sin_t) + (yi * cos_t) + ctr_y
+        ap = np.rint(ap).astype(int).clip(0, wd - 1)
+        bp = np.rint(bp).astype(int).clip(0, ht - 1)
+        return data[bp, ap]
+
+    def test_rotate_clip_uint16(self):
+        # uint16 (e.g. raw data) is rotated by nearest neighbor, whether
+        # or not OpenCV is installed, so no new values are introduced
+        data = np.arange(40 * 50, dtype=np.uint16).reshape((40, 50))
+
+        res = trcalc.rotate_clip(data, 30.0)
+
+        assert res.dtype == data.dtype
+        np.testing.assert_array_equal(res,
+                                      self._rotate_clip_nearest(data, 30.0))
+
     def test_get_scaled_cutout_wdht_view(self):
 
         data = self._2ddata()
@@ -79,3 +107,29 @@ class TestTrcalc:
         new_data = data[view]
         assert new_data.shape == (4, 4, 4)
         assert np.allclose(new_data, res)
+
+    def test_rotate_clip_float(self):
+        # float data always takes the numpy path
+        data = np.arange(40 * 50, dtype=float).reshape((40, 50))
+
+        res = trcalc.rotate_clip(data, 30.0)
+
+        np.testing.assert_array_equal(res,
+                                      self._rotate_clip_nearest(data, 30.0))
+
+    @pytest.mark.parametrize('dtype', [np.uint8, np.uint16, float])
+    def test_rotate_clip_out(self, dtype):
+        data = (np.arange(40 * 50 * 3) % 256).astype(dtype)
+        data = data.reshape((40, 50, 3))
+        expected = trcalc.rotate_clip(data, 30.0)
+
+        out = np.zeros_like(data)
+        res = trcalc.rotate_clip(data, 30.0, out=out)
+        assert res is out
+        np.testing.assert_array_equal(res, expected)
+
+        # output array may be the input array
+        data2 = data.copy()
+        res = trcalc.rotate_clip(data2, 30.0, out=data2)
+        assert res is data2
+        np.testing.assert_array_equal(res, expected)
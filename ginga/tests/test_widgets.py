@@ -0,0 +1,26 @@
+"""Unit Tests for the toolkit independent parts of the Widgets modules"""
+
+import pytest
+
+# web widgets need tornado, but no GUI toolkit
+Widgets = pytest.importorskip('ginga.web.pgw.Widgets')
+
+
+class TestComboBox(object):
+
+    def test_append_texts(self):
+        combobox = Widgets.ComboBox()
+        combobox.append_text('one')
+
+        combobox.append_texts(['two', 'three'])
+        combobox.append_texts(iter(['four']))
+
+        assert [combobox.get_alpha(i) for i in range(4)] == \
+            ['one', 'two', 'three', 'four']
+        combobox.set_index(2)
+        assert combobox.get_text() == 'three'
+
+        # appending leaves the current item alone
+        combobox.append_texts(['five'])
+        assert combobox.get_index() == 2
+        assert combobox.get_text() == 'three'
@@ -135,7 +135,11 @@ def rotate_clip(data_np, theta_deg, rotctr_x=None, rotctr_y=None,
         # opencv is fastest
         M = cv2.getRotationMatrix2D((rotctr_x, rotctr_y), theta_deg, 1)
 
-        newdata = cv2.warpAffine(data_np, M, (wd, ht))
+        if out is not None and not np.may_share_memory(out, data_np):
+            # have OpenCV write directly into the output array
+            newdata = cv2.warpAffine(data_np, M, (wd, ht), dst=out)
+        else:
+            newdata = cv2.warpAffine(data_np, M, (wd, ht))
         new_ht, new_wd = newdata.shape[:2]
         assert (wd == new_wd) and (ht == new_ht), \
             Exception("rotated cutout is %dx%d original=%dx%d" % (
@@ -143,7 +147,8 @@ def rotate_clip(data_np, theta_deg, rotctr_x=None, rotctr_y=None,
 
         newdata = newdata.astype(dtype, copy=False)
 
-        if out is not None:
+        if out is not None and newdata is not out:
+            # OpenCV could not use the output array as given
             out[:, :, ...] = newdata
             newdata = out
 
@@ -162,14 +167,18 @@ def rotate_clip(data_np, theta_deg, rotctr_x=None, rotctr_y=None,
     else:
         if logger is not None:
             logger.debug("rotating with numpy")
-        yi, xi = np.mgrid[0:ht, 0:wd]
-        xi -= rotctr_x
-        yi -= rotctr_y
+        # NOTE: x and y terms are calculated once per column and row,
+        # respectively, and broadcast to make the full index arrays--
+        # this avoids several full sized intermediate arrays
+        xi = np.arange(wd) - rotctr_x
+        yi = np.arange(ht) - rotctr_y
         cos_t = np.cos(np.radians(theta_deg))
         sin_t = np.sin(np.radians(theta_deg))
 
-        ap = (xi * cos_t) - (yi * sin_t) + rotctr_x
-        bp = (xi * sin_t) + (yi * cos_t) + rotctr_y
+        ap = ((xi * cos_t)[np.newaxis, :] - (yi * sin_t)[:, np.newaxis] +
+              rotctr_x)
+        bp = ((xi * sin_t)[np.newaxis, :] + (yi * cos_t)[:, np.newaxis] +
+              rotctr_y)
 
         #ap = np.rint(ap).clip(0, wd-1).astype(int)
         #bp = np.rint(bp).clip(0, ht-1).astype(int)
@@ -537,7 +546,10 @@ def get_scaled_cutout_basic2(data_np, p1, p2, scales,
 
 
 def transform(data_np, flip_x=False, flip_y=False, swap_xy=False):
+    """Flip and/or swap the axes of `data_np`.
 
+    NOTE: the result is a view of `data_np`; no data is copied.
+    """
     # Do transforms as necessary
     if flip_y:
         data_np = np.flipud(data_np)
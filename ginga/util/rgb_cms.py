@@ -235,9 +235,11 @@ def convert_profile_numpy_transform(image_np, transform):
     if not have_cms:
         return image_np
 
-    in_image_pil = to_image(image_np)
+    # NOTE: transform is applied per-pixel, so there is no need to flip
+    # the image going into or coming out of PIL
+    in_image_pil = to_image(image_np, flip_y=False)
     convert_profile_pil_transform(in_image_pil, transform, inPlace=True)
-    image_out = from_image(in_image_pil)
+    image_out = from_image(in_image_pil, flip_y=False)
     return image_out
 
 
@@ -386,6 +388,16 @@ def have_profile(name):
     return name in profile_dict.keys()
 
 
+def is_same_profile(name1, name2):
+    """Returns True if profile names `name1` and `name2` refer to the
+    same profile (e.g. one is an alias of the other).
+    """
+    if name1 == name2:
+        return True
+    prof1, prof2 = profile_dict.get(name1, None), profile_dict.get(name2, None)
+    return prof1 is not None and prof1 is prof2
+
+
 def get_profiles():
     names = list(profile_dict.keys())
     names.sort()
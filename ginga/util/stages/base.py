@@ -4,6 +4,10 @@
 # This is open-source software licensed under a BSD license.
 # Please see the file LICENSE.txt for details.
 #
+import os
+
+import numpy as np
+
 from ginga.misc import Bunch
 from ginga.util.action import AttrAction
 
@@ -18,6 +22,9 @@ class Stage(object):
     """Class to handle a pipeline stage."""
 
     _stagename = 'generic'
+    # enables extra sanity checks on data passed between stages in some
+    # performance sensitive pipelines
+    debug = 'GINGA_PIPELINE_DEBUG' in os.environ
 
     def __init__(self):
         super().__init__()
@@ -32,6 +39,8 @@ class Stage(object):
         self.logger = None
         self.result = None
         self.gui_up = False
+        # work buffer, see _get_buf()
+        self._buf = None
 
     def build_gui(self, container):
         """subclass can override this to build some kind of GUI."""
@@ -60,6 +69,18 @@ class Stage(object):
     def bypass(self, tf):
         self._bypass = tf
 
+    def _get_buf(self, shape, dtype):
+        """Return a work buffer of the given shape and dtype.
+
+        The buffer from the previous call is reused if it matches,
+        otherwise a new one is allocated.  Contents are undefined.
+        """
+        buf = self._buf
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buf = buf
+        return buf
+
     def verify_2d(self, data):
         if data is not None and len(data.shape) < 2:
             raise StageError("Expecting a 2D or greater array in final stage")
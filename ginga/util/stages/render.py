@@ -8,12 +8,99 @@ the default renderer for standard widget backends.
 [createbg] => [overlays] => [iccprof] => [flipswap] => [rotate] => [output]
 
 """
+import importlib.util
+
 import numpy as np
 
 from ginga import trcalc, RGBImage
+from ginga.util import rgb_cms, pipeline
 
 from .base import Stage, StageError
 
+# optional numba package speeds up compositing in the Merge stage.  It is
+# slow to import, so it is only imported (and the kernel compiled) the
+# first time it is needed--see _get_composite_kernel()
+have_numba = importlib.util.find_spec('numba') is not None
+_composite_kernel = None
+
+
+def _get_composite_kernel():
+    """Return the numba compositing kernel, or None if numba is not
+    available.
+    """
+    global have_numba, _composite_kernel
+    if _composite_kernel is not None or not have_numba:
+        return _composite_kernel
+    try:
+        import numba
+    except ImportError:
+        have_numba = False
+        return None
+
+    # NOTE: an explicit signature with any-layout arrays is compiled
+    # once, instead of once for each layout of the array slices we pass
+    @numba.njit('void(uint8[:, :, :], uint8[:, :, :], uint8[:, :], int64)',
+                parallel=True, cache=True)
+    def _composite_rgb_alpha(dst, src, alpha, max_val):
+        """Composite RGB array `src`, with separate alpha array `alpha`,
+        onto RGBA array `dst` (of the same height and width) in one pass.
+        """
+        ht, wd = src.shape[0], src.shape[1]
+        for y in numba.prange(ht):
+            for x in range(wd):
+                a = alpha[y, x] / max_val
+                for c in range(3):
+                    dst[y, x, c] = a * src[y, x, c] + (1.0 - a) * dst[y, x, c]
+                dst[y, x, 3] = max_val
+
+    _composite_kernel = _composite_rgb_alpha
+    return _composite_kernel
+
+
+def _convert_alpha(alpha, dtype):
+    """Scale alpha array `alpha` to the value range of `dtype`."""
+    if alpha.dtype == dtype:
+        return alpha
+    if alpha.dtype.kind not in 'ui' or np.dtype(dtype).kind not in 'ui':
+        return trcalc.array_convert(alpha, dtype)
+
+    # integer to integer: scale and cast in one pass, without making
+    # a full size floating point intermediate
+    scale = np.iinfo(dtype).max / np.iinfo(alpha.dtype).max
+    res = np.empty(alpha.shape, dtype=dtype)
+    np.multiply(alpha, scale, out=res, casting='unsafe')
+    return res
+
+
+def _merge_rgb_alpha(dstarr, pos, rgbarr, alpha):
+    """Merge RGB array `rgbarr` with alpha array `alpha` into RGBA array
+    `dstarr` at position `pos`, clipping as necessary.
+    """
+    dst_ht, dst_wd = dstarr.shape[:2]
+    src_ht, src_wd = rgbarr.shape[:2]
+    dst_x, dst_y = pos
+    src_x, src_y = 0, 0
+
+    # Trim off parts of rgbarr that would be "hidden"
+    # outside of the dstarr edges
+    if dst_y < 0:
+        src_y, src_ht, dst_y = -dst_y, src_ht + dst_y, 0
+    if dst_x < 0:
+        src_x, src_wd, dst_x = -dst_x, src_wd + dst_x, 0
+    src_ht = min(src_ht, dst_ht - dst_y)
+    src_wd = min(src_wd, dst_wd - dst_x)
+
+    if src_wd <= 0 or src_ht <= 0:
+        # nothing to do
+        return
+
+    max_val = np.iinfo(dstarr.dtype).max
+    composite = _get_composite_kernel()
+    composite(dstarr[dst_y:dst_y + src_ht, dst_x:dst_x + src_wd],
+              rgbarr[src_y:src_y + src_ht, src_x:src_x + src_wd],
+              alpha[src_y:src_y + src_ht, src_x:src_x + src_wd],
+              max_val)
+
 
 class CreateBg(Stage):
     """Create the background RGB image, sized to fit the area that needs to
@@ -27,6 +114,14 @@ class CreateBg(Stage):
 
         self.viewer = viewer
         self.dtype = np.uint8
+        # cache of recently made background arrays, keyed by
+        # (side, order, bg color); sized to hold the last couple of
+        # window sizes so that resizing back and forth is cheap
+        self._bg_cache = dict()
+        self._bg_cache_size = 2
+
+    def invalidate(self):
+        self._bg_cache = dict()
 
     def run(self, prev_stage):
         if prev_stage is not None:
@@ -51,10 +146,21 @@ class CreateBg(Stage):
         ncx, ncy = wd // 2, ht // 2
         depth = len(state.order)
 
-        # make backing image with the background color
+        # make backing image with the background color, or reuse one
+        # we made previously.  NOTE: the Overlays stage copies this
+        # array before drawing into it, so it is safe to share it
         r, g, b = self.viewer.get_bg()
-        res_np = trcalc.make_filled_array((ht, wd, depth), self.dtype,
-                                          state.order, r, g, b, 1.0)
+        key = (side, state.order, (r, g, b))
+        res_np = self._bg_cache.get(key, None)
+        if res_np is None:
+            res_np = trcalc.make_filled_array((ht, wd, depth), self.dtype,
+                                              state.order, r, g, b, 1.0)
+            res_np.flags.writeable = False
+
+            if len(self._bg_cache) >= self._bg_cache_size:
+                # evict the oldest entry
+                del self._bg_cache[next(iter(self._bg_cache))]
+            self._bg_cache[key] = res_np
 
         self.pipeline.set(org_dim=(wd, ht), org_off=(ncx, ncy))
         self.pipeline.send(res_np=res_np)
@@ -73,9 +179,8 @@ class ICCProf(Stage):
 
     def run(self, prev_stage):
         data = self.pipeline.get_data(prev_stage)
-        self.verify_2d(data)
-
-        from ginga.util import rgb_cms
+        if self.debug:
+            self.verify_2d(data)
 
         working_profile = rgb_cms.working_profile
         t_ = self.viewer.get_settings()
@@ -92,6 +197,14 @@ class ICCProf(Stage):
         proofprof_name = t_.get('icc_proof_profile', None)
         proof_intent = t_.get('icc_proof_intent', 'perceptual')
         use_black_pt = t_.get('icc_black_point_compensation', False)
+
+        if (proofprof_name is None and
+            rgb_cms.is_same_profile(working_profile, output_profile)):
+            # conversion would be an identity transform
+            self.pipeline.set(icc_output_profile=output_profile)
+            self.pipeline.send(res_np=data)
+            return
+
         try:
             data = rgb_cms.convert_profile_fromto(data,
                                                   working_profile,
@@ -127,7 +240,8 @@ class FlipSwap(Stage):
 
     def run(self, prev_stage):
         data = self.pipeline.get_data(prev_stage)
-        self.verify_2d(data)
+        if self.debug:
+            self.verify_2d(data)
 
         xoff, yoff = self.pipeline.get('org_off')
         if not self._bypass:
@@ -135,7 +249,9 @@ class FlipSwap(Stage):
 
             ht, wd = data.shape[:2]
 
-            # Do transforms as necessary
+            # Do transforms as necessary (these produce views, not
+            # copies; the Rotate and Output stages make contiguous
+            # arrays as needed)
             data = trcalc.transform(data, flip_x=flip_x, flip_y=flip_y,
                                     swap_xy=swap_xy)
             if flip_y:
@@ -162,15 +278,18 @@ class Rotate(Stage):
 
     def run(self, prev_stage):
         data = self.pipeline.get_data(prev_stage)
-        self.verify_2d(data)
+        if self.debug:
+            self.verify_2d(data)
 
         if not self._bypass:
             rot_deg = self.viewer.get_rotation()
 
             if not np.isclose(rot_deg, 0.0):
-                data = np.copy(data)
-                #data = np.ascontiguousarray(data)
-                data = trcalc.rotate_clip(data, -rot_deg, out=data,
+                # NOTE: data may be a view of an earlier stage's result,
+                # so we rotate into our own buffer rather than in place
+                out = self._get_buf(data.shape, data.dtype)
+                data = np.ascontiguousarray(data)
+                data = trcalc.rotate_clip(data, -rot_deg, out=out,
                                           logger=self.logger)
 
             # apply other transforms
@@ -216,14 +335,14 @@ class Output(Stage):
         ##         and data.dtype == np.dtype(np.uint8)
         ##         and data.shape[2] in [3, 4]), \
         ##     StageError("Expecting a RGB[A] image in final stage")
-        self.verify_2d(data)
+        if self.debug:
+            self.verify_2d(data)
 
         state = self.pipeline.get('state')
         out_order = state.order
 
         if not self._bypass:
             ht, wd = data.shape[:2]
-            state = self.pipeline.get('state')
             win_wd, win_ht = state.win_dim
             if wd < win_wd or ht < win_ht:
                 raise StageError("pipeline output doesn't cover window")
@@ -238,8 +357,21 @@ class Output(Stage):
 
             # reorder image for renderer's desired format
             dst_order = self.viewer.renderer.get_rgb_order()
-            data = trcalc.reorder_image(dst_order, data, state.order)
-            data = np.ascontiguousarray(data)
+            if dst_order == state.order:
+                out = self._get_buf(data.shape, data.dtype)
+                np.copyto(out, data)
+                data = out
+            elif sorted(dst_order) == sorted(state.order):
+                # simple permutation of channels: crop and reorder in
+                # one copy into our output buffer
+                perm = [state.order.index(c) for c in dst_order]
+                out = self._get_buf(data.shape, data.dtype)
+                # NOTE: mode='clip' avoids np.take buffering the output
+                np.take(data, perm, axis=2, out=out, mode='clip')
+                data = out
+            else:
+                # NOTE: makes a new contiguous array
+                data = trcalc.reorder_image(dst_order, data, state.order)
             out_order = dst_order
 
         self.pipeline.set(out_order=out_order)
@@ -267,6 +399,7 @@ class Overlays(Stage):
         super(Overlays, self).__init__()
 
         self.viewer = viewer
+        self._pipe_vals = dict()
 
     def run(self, prev_stage):
         whence = self.pipeline.get('whence')
@@ -279,9 +412,27 @@ class Overlays(Stage):
             return
 
         bgarr = self.pipeline.get_data(prev_stage)
-        self.verify_2d(bgarr)
+        if self.debug:
+            self.verify_2d(bgarr)
 
-        dstarr = np.copy(bgarr)
+        dstarr = self._get_buf(bgarr.shape, bgarr.dtype)
+        np.copyto(dstarr, bgarr)
+
+        # get extent of our data coverage in the window--this is the
+        # same for every image, so calculate it once here for Scale
+        # TODO: get rid of padding by fixing get_draw_rect() which
+        # doesn't quite get the coverage right at high magnifications
+        pad = 1.0
+        pts = np.asarray(self.viewer.get_draw_rect()).T
+        xmin = int(np.min(pts[0])) - pad
+        ymin = int(np.min(pts[1])) - pad
+        xmax = int(np.ceil(np.max(pts[0]))) + pad
+        ymax = int(np.ceil(np.max(pts[1]))) + pad
+
+        # values passed to every image's pipeline
+        self._pipe_vals = dict(state=self.pipeline.get('state'),
+                               dstarr=dstarr,
+                               draw_bounds=(xmin, ymin, xmax, ymax))
         self.pipeline.set(dstarr=dstarr)
 
         p_canvas = self.viewer.get_private_canvas()
@@ -293,14 +444,22 @@ class Overlays(Stage):
         if not hasattr(canvas, 'objects'):
             return
 
-        for obj in canvas.get_objects():
-            if hasattr(obj, 'prepare_image'):
-                obj.prepare_image(self.viewer, whence)
-            elif obj.is_compound() and (obj != canvas):
-                self._overlay_images(obj, whence=whence)
+        # walk the canvas tree iteratively, keeping drawing order
+        stack = [(canvas, iter(canvas.get_objects()))]
+        while len(stack) > 0:
+            parent, objs = stack[-1]
+            for obj in objs:
+                if hasattr(obj, 'prepare_image'):
+                    obj.prepare_image(self.viewer, whence)
+                elif (obj.is_compound() and (obj != parent) and
+                      hasattr(obj, 'objects')):
+                    # descend, resuming this level when done
+                    stack.append((obj, iter(obj.get_objects())))
+                    break
+            else:
+                stack.pop()
 
     def _prepare_image(self, cvs_img, cache, whence):
-        from ginga.util import pipeline
         pipe = cache.get('minipipe', None)
         if pipe is None:
             stages = [Scale(self.viewer),    # 0
@@ -309,9 +468,7 @@ class Overlays(Stage):
             pipe = pipeline.Pipeline(self.logger, stages)
             pipe.name = 'image-overlays'
             cache.minipipe = pipe
-        state = self.pipeline.get('state')
-        pipe.set(whence=whence, cvs_img=cvs_img, state=state,
-                 dstarr=self.pipeline.get('dstarr'))
+        pipe.set(whence=whence, cvs_img=cvs_img, **self._pipe_vals)
         if whence <= 0:
             pipe.run_from(pipe[0])
             return
@@ -322,7 +479,6 @@ class Overlays(Stage):
         pipe.run_from(pipe[1])
 
     def _prepare_norm_image(self, cvs_img, cache, whence):
-        from ginga.util import pipeline
         pipe = cache.get('minipipe', None)
         if pipe is None:
             stages = [Scale(self.viewer),    # 0
@@ -333,9 +489,7 @@ class Overlays(Stage):
             pipe = pipeline.Pipeline(self.logger, stages)
             pipe.name = 'image-overlays'
             cache.minipipe = pipe
-        state = self.pipeline.get('state')
-        pipe.set(whence=whence, cvs_img=cvs_img, state=state,
-                 dstarr=self.pipeline.get('dstarr'))
+        pipe.set(whence=whence, cvs_img=cvs_img, **self._pipe_vals)
         if whence <= 0:
             pipe.run_from(pipe[0])
             return
@@ -375,17 +529,12 @@ class Scale(Stage):
             return
 
         data_np = image.get_data()
-        self.verify_2d(data_np)
+        if self.debug:
+            self.verify_2d(data_np)
 
         # get extent of our data coverage in the window
-        # TODO: get rid of padding by fixing get_draw_rect() which
-        # doesn't quite get the coverage right at high magnifications
-        pad = 1.0
-        pts = np.asarray(self.viewer.get_draw_rect()).T
-        xmin = int(np.min(pts[0])) - pad
-        ymin = int(np.min(pts[1])) - pad
-        xmax = int(np.ceil(np.max(pts[0]))) + pad
-        ymax = int(np.ceil(np.max(pts[1]))) + pad
+        # (calculated once per frame by the Overlays stage)
+        xmin, ymin, xmax, ymax = self.pipeline.get('draw_bounds')
 
         # get destination location in data_coords
         img = cvs_img
@@ -471,7 +620,8 @@ class Reorder(Stage):
         if data is None:
             self.pipeline.send(res_np=None)
             return
-        self.verify_2d(data)
+        if self.debug:
+            self.verify_2d(data)
 
         cvs_img = self.pipeline.get('cvs_img')
 
@@ -520,7 +670,8 @@ class Merge(Stage):
         if rgbarr is None:
             # nothing to merge
             return
-        self.verify_2d(rgbarr)
+        if self.debug:
+            self.verify_2d(rgbarr)
 
         if len(rgbarr.shape) != 3 or rgbarr.shape[2] < 3:
             raise StageError("Not an RGB array (shape={})".format(rgbarr.shape))
@@ -543,17 +694,31 @@ class Merge(Stage):
         # merge back in alpha layer if one was stripped off earler
         # in the pipeline
         alpha = self.pipeline.get('alpha')
-        if alpha is not None and 'A' in state.order:
-            a_idx = state.order.index('A')
+        a_idx = state.a_idx
+        if (alpha is not None and state.order == 'RGBA' and
+            rgbarr.shape[2] == 3 and rgbarr.dtype == dstarr.dtype and
+            dstarr.dtype == np.uint8 and
+            _get_composite_kernel() is not None):
+            # fast path: composite RGB and alpha directly into the
+            # destination without inserting an alpha layer first
+            alpha = _convert_alpha(alpha, rgbarr.dtype)
+            _merge_rgb_alpha(dstarr, cvs_pos, rgbarr, alpha)
+
+            cache = cvs_img.get_cache(self.viewer)
+            cache.drawn = True
+            return
+
+        if alpha is not None and a_idx >= 0:
             if rgbarr.shape[2] != 4:
                 #raise StageError("RGB array lacks alpha band (shape={})".format(rgbarr.shape))
-                # insert an empty alpha layer to accomodate
-                rgbarr = np.insert(rgbarr, a_idx,
-                                   np.zeros(rgbarr.shape[:2],
-                                            dtype=rgbarr.dtype),
-                                   axis=2)
+                # copy into a 4-channel work buffer to accomodate the
+                # alpha layer
+                buf = self._get_buf(rgbarr.shape[:2] + (4,), rgbarr.dtype)
+                buf[..., :a_idx] = rgbarr[..., :a_idx]
+                buf[..., a_idx + 1:] = rgbarr[..., a_idx:]
+                rgbarr = buf
             # normalize alpha array to the final output range
-            alpha = trcalc.array_convert(alpha, rgbarr.dtype)
+            alpha = _convert_alpha(alpha, rgbarr.dtype)
             rgbarr[..., a_idx] = alpha
 
         # composite the image into the destination array at the
@@ -591,7 +756,8 @@ class Cuts(Stage):
         if data is None:
             self.pipeline.send(res_np=None)
             return
-        self.verify_2d(data)
+        if self.debug:
+            self.verify_2d(data)
 
         cvs_img = self.pipeline.get('cvs_img')
 
@@ -618,9 +784,10 @@ class Cuts(Stage):
                                      vmin=vmin, vmax=vmax)
 
         # NOTE: optimization to prevent multiple coercions in
-        # RGBMap
-        if not np.issubdtype(res_np.dtype, np.uint):
-            res_np = res_np.astype(np.uint)
+        # RGBMap.  Use the narrowest unsigned type that can hold the
+        # hash range, to cut down the bytes moved into the next stage
+        dtype = np.uint16 if vmax < 65536 else np.uint32
+        res_np = res_np.astype(dtype, copy=False)
 
         self.pipeline.send(res_np=res_np)
 
@@ -644,7 +811,8 @@ class RGBMap(Stage):
         if arr_in is None:
             self.pipeline.send(res_np=None)
             return
-        self.verify_2d(arr_in)
+        if self.debug:
+            self.verify_2d(arr_in)
 
         cvs_img = self.pipeline.get('cvs_img')
         state = self.pipeline.get('state')
@@ -654,11 +822,7 @@ class RGBMap(Stage):
         else:
             rgbmap = self.viewer.get_rgbmap()
 
-        # See NOTE in Cuts
-        if not np.issubdtype(arr_in.dtype, np.dtype(np.uint)):
-            arr_in = arr_in.astype(np.uint)
-
-        # get RGB mapped array
+        # get RGB mapped array (the mapper handles any index dtype)
         arr_out = rgbmap.get_rgb_array(arr_in, order=state.order)
 
         self.pipeline.send(res_np=arr_out)
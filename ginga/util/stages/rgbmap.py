@@ -1,6 +1,8 @@
 # This is open-source software licensed under a BSD license.
 # Please see the file LICENSE.txt for details.
 #
+import importlib.util
+
 import numpy as np
 
 from ginga import cmap, imap, ColorDist
@@ -9,6 +11,42 @@ from ginga.gw import Widgets, ColorBar
 
 from .base import Stage, StageAction
 
+# optional numba package speeds up color mapping.  It is slow to import,
+# so it is only imported (and the kernel compiled) the first time it is
+# needed--see _get_lut_kernel()
+have_numba = importlib.util.find_spec('numba') is not None
+_lut_kernel = None
+
+
+def _get_lut_kernel():
+    """Return the numba color mapping kernel, or None if numba is not
+    available.
+    """
+    global have_numba, _lut_kernel
+    if _lut_kernel is not None or not have_numba:
+        return _lut_kernel
+    try:
+        import numba
+    except ImportError:
+        have_numba = False
+        return None
+
+    @numba.njit(parallel=True, cache=True)
+    def _apply_lut_rgb(data, lut, out):
+        """Map 2D index array `data` through the (N, 3) lookup table
+        `lut` into the RGB array `out`, clipping indexes to the table.
+        """
+        n = lut.shape[0] - 1
+        for i in numba.prange(data.shape[0]):
+            for j in range(data.shape[1]):
+                k = min(data[i, j], n)
+                out[i, j, 0] = lut[k, 0]
+                out[i, j, 1] = lut[k, 1]
+                out[i, j, 2] = lut[k, 2]
+
+    _lut_kernel = _apply_lut_rgb
+    return _lut_kernel
+
 
 class RGBMap(Stage):
 
@@ -21,6 +59,10 @@ class RGBMap(Stage):
         self.calg_names = ColorDist.get_dist_names()
         self.cmap_names = cmap.get_names()
         self.imap_names = imap.get_names()
+        # name -> position in the choice lists above
+        self._calg_index = {n: i for i, n in enumerate(self.calg_names)}
+        self._cmap_index = {n: i for i, n in enumerate(self.cmap_names)}
+        self._imap_index = {n: i for i, n in enumerate(self.imap_names)}
         self.order = 'RGB'
 
         self._calg_name = 'linear'
@@ -33,6 +75,23 @@ class RGBMap(Stage):
 
         self.viewer = None
         self.fv = None
+        # built on demand, see _ensure_colorbar()
+        self.colorbar = None
+        # buffer for casting input to an index type, reused between runs
+        self._cast_buf = None
+        # slider changes waiting to be applied, see _flush_pending()
+        self._pending = dict()
+        # widget values waiting to be set, see _flush_widget_updates()
+        self._pending_widget_updates = dict()
+        # True while we are changing our own RGBMapper, see _set_rgbmap()
+        self._in_setter = False
+        # bumped whenever the mapping changes; used with the previous
+        # stage's last result and our own to skip remapping an unchanged
+        # image
+        self._settings_version = 0
+        self._last_key = None
+        self._last_src = None
+        self._last_res = None
 
     def build_gui(self, container):
         self.viewer = self.pipeline.get('viewer')
@@ -71,15 +130,10 @@ class RGBMap(Stage):
                                      lambda w: self.set_default_distmaps())
 
         combobox = b.algorithm
-        options = []
-        for name in self.calg_names:
-            options.append(name)
-            combobox.append_text(name)
-        try:
-            index = self.calg_names.index(self._calg_name)
+        combobox.append_texts(self.calg_names)
+        index = self._calg_index.get(self._calg_name, None)
+        if index is not None:
             combobox.set_index(index)
-        except Exception:
-            pass
         combobox.add_callback('activated', self.set_calg_cb)
 
         fr.set_widget(w)
@@ -118,26 +172,16 @@ class RGBMap(Stage):
         fr.set_widget(w)
 
         combobox = b.colormap
-        options = []
-        for name in self.cmap_names:
-            options.append(name)
-            combobox.append_text(name)
-        try:
-            index = self.cmap_names.index(self._cmap_name)
-        except Exception:
-            index = self.cmap_names.index('gray')
+        combobox.append_texts(self.cmap_names)
+        index = self._cmap_index.get(self._cmap_name,
+                                     self._cmap_index['gray'])
         combobox.set_index(index)
         combobox.add_callback('activated', self.set_cmap_cb)
 
         combobox = b.intensity
-        options = []
-        for name in self.imap_names:
-            options.append(name)
-            combobox.append_text(name)
-        try:
-            index = self.imap_names.index(self._imap_name)
-        except Exception:
-            index = self.imap_names.index('ramp')
+        combobox.append_texts(self.imap_names)
+        index = self._imap_index.get(self._imap_name,
+                                     self._imap_index['ramp'])
         combobox.set_index(index)
         combobox.add_callback('activated', self.set_imap_cb)
 
@@ -179,8 +223,18 @@ class RGBMap(Stage):
         fr.set_widget(w)
         top.add_widget(fr, stretch=0)
 
-        # add colorbar
-        fr = Widgets.Frame("Color Map")
+        # placeholder for the colorbar, which is built the first time the
+        # stage is opened (see resume())
+        vbox = Widgets.VBox()
+        self.w.cbar_box = vbox
+        top.add_widget(vbox, stretch=0)
+
+        container.set_widget(top)
+
+    def _ensure_colorbar(self):
+        """Build the colorbar, if it has not been built yet."""
+        if self.colorbar is not None or not self.gui_up:
+            return
         height = 50
         settings = self.rgbmap.get_settings()
         settings.set(cbar_height=height, fontsize=10)
@@ -195,9 +249,60 @@ class RGBMap(Stage):
         self.colorbar = cbar
         #cbar.add_callback('motion', self.cbar_value_cb)
 
-        top.add_widget(cbar_w, stretch=0)
-
-        container.set_widget(top)
+        self.w.cbar_box.add_widget(cbar_w, stretch=0)
+
+    def resume(self):
+        # called when our panel is opened
+        self._ensure_colorbar()
+
+    def _bump(self):
+        """Note that the mapping has changed."""
+        self._settings_version += 1
+
+    def get_output_signature(self, data):
+        """Return a hashable value identifying the output this stage
+        produces for input array `data`.  If two calls return equal
+        values, then the mapping and the identity of the input array are
+        unchanged.
+
+        NOTE: `data` is identified by its id(), so the signature is only
+        meaningful while the caller holds a reference to `data`.  Changes
+        made to the contents of `data` in place are not reflected in the
+        signature; callers that may see such changes need to track them
+        separately (run() does this by checking whether the previous stage
+        has run again).
+        """
+        return (self._settings_version, self.order, data.shape, data.dtype,
+                id(data))
+
+    def _set_rgbmap(self, **kwargs):
+        """Change settings of our RGBMapper without triggering a pipeline
+        run from rgbmap_changed_cb(); our callers run the pipeline (or
+        schedule a run) themselves.
+        """
+        self._bump()
+        self._in_setter = True
+        try:
+            self.rgbmap.get_settings().set(**kwargs)
+        finally:
+            self._in_setter = False
+
+    def _update_widget(self, name, method, val):
+        """Schedule a call of widget method `method` with `val` on the
+        widget named `name`; several updates are applied together by
+        _flush_widget_updates().
+        """
+        self._pending_widget_updates[name] = (method, val)
+        self.fv.gui_do_oneshot('pl-rgbmap-ui-{}'.format(id(self)),
+                               self._flush_widget_updates)
+
+    def _flush_widget_updates(self):
+        pending, self._pending_widget_updates = (self._pending_widget_updates,
+                                                 dict())
+        if not self.gui_up:
+            return
+        for name, (method, val) in pending.items():
+            getattr(self.w[name], method)(val)
 
     @property
     def calg_name(self):
@@ -205,11 +310,18 @@ class RGBMap(Stage):
 
     @calg_name.setter
     def calg_name(self, val):
+        if val not in self._calg_index:
+            # e.g. a name from an imported pipeline that is no longer
+            # available--fall back to the default
+            if self.logger is not None:
+                self.logger.warning("unknown color distribution '{}', "
+                                    "using 'linear'".format(val))
+            val = 'linear'
         self._calg_name = val
         if self.gui_up:
-            idx = self.calg_names.index(val)
-            self.w.algorithm.set_index(idx)
-            self.rgbmap.set_color_algorithm(val)
+            idx = self._calg_index[val]
+            self._update_widget('algorithm', 'set_index', idx)
+            self._set_rgbmap(color_algorithm=val)
 
     @property
     def cmap_name(self):
@@ -217,11 +329,18 @@ class RGBMap(Stage):
 
     @cmap_name.setter
     def cmap_name(self, val):
+        if val not in self._cmap_index:
+            # e.g. a name from an imported pipeline that is no longer
+            # available--fall back to the default
+            if self.logger is not None:
+                self.logger.warning("unknown color map '{}', "
+                                    "using 'gray'".format(val))
+            val = 'gray'
         self._cmap_name = val
         if self.gui_up:
-            idx = self.cmap_names.index(val)
-            self.w.colormap.set_index(idx)
-            self.rgbmap.set_color_map(val)
+            idx = self._cmap_index[val]
+            self._update_widget('colormap', 'set_index', idx)
+            self._set_rgbmap(color_map=val)
 
     @property
     def imap_name(self):
@@ -229,11 +348,18 @@ class RGBMap(Stage):
 
     @imap_name.setter
     def imap_name(self, val):
+        if val not in self._imap_index:
+            # e.g. a name from an imported pipeline that is no longer
+            # available--fall back to the default
+            if self.logger is not None:
+                self.logger.warning("unknown intensity map '{}', "
+                                    "using 'ramp'".format(val))
+            val = 'ramp'
         self._imap_name = val
         if self.gui_up:
-            idx = self.imap_names.index(val)
-            self.w.intensity.set_index(idx)
-            self.rgbmap.set_intensity_map(val)
+            idx = self._imap_index[val]
+            self._update_widget('intensity', 'set_index', idx)
+            self._set_rgbmap(intensity_map=val)
 
     @property
     def invert_cmap(self):
@@ -243,8 +369,8 @@ class RGBMap(Stage):
     def invert_cmap(self, tf):
         self._invert_cmap = tf
         if self.gui_up:
-            self.w.invert_cmap.set_state(tf)
-            self.rgbmap.get_settings().set(color_map_invert=tf)
+            self._update_widget('invert_cmap', 'set_state', tf)
+            self._set_rgbmap(color_map_invert=tf)
 
     @property
     def rotate_cmap(self):
@@ -254,8 +380,9 @@ class RGBMap(Stage):
     def rotate_cmap(self, pct):
         self._rotate_cmap_pct = pct
         if self.gui_up:
-            self.w.rotate_cmap.set_value(int(pct * 100.0))
-            self.rgbmap.get_settings().set(color_map_rot_pct=pct)
+            self._update_widget('rotate_cmap', 'set_value',
+                                int(pct * 100.0))
+            self._set_rgbmap(color_map_rot_pct=pct)
 
     @property
     def contrast(self):
@@ -265,8 +392,8 @@ class RGBMap(Stage):
     def contrast(self, pct):
         self._contrast = pct
         if self.gui_up:
-            self.w.contrast.set_value(int(pct * 100))
-            self.rgbmap.get_settings().set(contrast=pct)
+            self._update_widget('contrast', 'set_value', int(pct * 100))
+            self._set_rgbmap(contrast=pct)
 
     @property
     def brightness(self):
@@ -276,34 +403,41 @@ class RGBMap(Stage):
     def brightness(self, pct):
         self._brightness = pct
         if self.gui_up:
-            self.w.brightness.set_value(int(pct * 100))
-            self.rgbmap.get_settings().set(brightness=pct)
+            self._update_widget('brightness', 'set_value', int(pct * 100))
+            self._set_rgbmap(brightness=pct)
+
+    def _rerun(self):
+        """Run the pipeline from this stage after a settings change."""
+        if self._bypass:
+            # our settings have no effect on the output while bypassed
+            return
+        self.pipeline.run_from(self)
 
     def set_cmap_cb(self, w, index):
         """This callback is invoked when the user selects a new color
         map from the UI."""
         old_cmap_name = self._cmap_name
-        name = cmap.get_names()[index]
+        name = self.cmap_names[index]
         self.cmap_name = name
         self.pipeline.push(StageAction(self,
                                        dict(cmap_name=old_cmap_name),
                                        dict(cmap_name=self._cmap_name),
                                        descr="rgbmap / change cmap"))
 
-        self.pipeline.run_from(self)
+        self._rerun()
 
     def set_imap_cb(self, w, index):
         """This callback is invoked when the user selects a new intensity
         map from the preferences pane."""
         old_imap_name = self._imap_name
-        name = imap.get_names()[index]
+        name = self.imap_names[index]
         self.imap_name = name
         self.pipeline.push(StageAction(self,
                                        dict(imap_name=old_imap_name),
                                        dict(imap_name=self._imap_name),
                                        descr="rgbmap / change imap"))
 
-        self.pipeline.run_from(self)
+        self._rerun()
 
     def set_calg_cb(self, w, index):
         """This callback is invoked when the user selects a new color
@@ -316,18 +450,39 @@ class RGBMap(Stage):
                                        dict(calg_name=self._calg_name),
                                        descr="rgbmap / change calg"))
 
-        self.pipeline.run_from(self)
+        self._rerun()
+
+    def _schedule_pending(self, attr, old_val, new_val, descr):
+        """Record a change from a slider, to be applied (along with any
+        others that arrive in the meantime) by _flush_pending().
+        """
+        if attr in self._pending:
+            # keep the value from before the first of the coalesced changes
+            old_val = self._pending[attr][0]
+        self._pending[attr] = (old_val, new_val, descr)
+        self.fv.gui_do_oneshot('pl-rgbmap-flush-{}'.format(id(self)),
+                               self._flush_pending)
+
+    def _flush_pending(self):
+        """Push a single undoable action for all the pending slider
+        changes and run the pipeline once.
+        """
+        pending, self._pending = self._pending, dict()
+        if len(pending) == 0:
+            return
+        old = {attr: tup[0] for attr, tup in pending.items()}
+        new = {attr: tup[1] for attr, tup in pending.items()}
+        descr = "; ".join([tup[2] for tup in pending.values()])
+        self.pipeline.push(StageAction(self, old, new, descr=descr))
+
+        self._rerun()
 
     def rotate_cmap_cb(self, w, val):
         old_val = self._rotate_cmap_pct
         pct = val / 100.0
         self.rotate_cmap = pct
-        self.pipeline.push(StageAction(self,
-                                       dict(rotate_cmap=old_val),
-                                       dict(rotate_cmap=self._rotate_cmap_pct),
-                                       descr=f"rgbmap / rotate cmap: {pct}"))
-
-        self.pipeline.run_from(self)
+        self._schedule_pending('rotate_cmap', old_val, self._rotate_cmap_pct,
+                               f"rgbmap / rotate cmap: {pct}")
 
     def invert_cmap_cb(self, w, tf):
         old_val = self._invert_cmap
@@ -337,7 +492,7 @@ class RGBMap(Stage):
                                        dict(invert_cmap=self._invert_cmap),
                                        descr=f"rgbmap / invert cmap {tf}"))
 
-        self.pipeline.run_from(self)
+        self._rerun()
 
     def unrotate_cmap_cb(self, w):
         self.rotate_cmap_cb(w, 0)
@@ -352,29 +507,21 @@ class RGBMap(Stage):
         self.cmap_name = cmap_name
         self.imap_name = imap_name
 
-        self.pipeline.run_from(self)
+        self._rerun()
 
     def contrast_set_cb(self, w, val):
         old_val = self._contrast
         pct = val / 100.0
         self.contrast = pct
-        self.pipeline.push(StageAction(self,
-                                       dict(contrast=old_val),
-                                       dict(contrast=self._contrast),
-                                       descr=f"rgbmap / contrast: {pct}"))
-
-        self.pipeline.run_from(self)
+        self._schedule_pending('contrast', old_val, self._contrast,
+                               f"rgbmap / contrast: {pct}")
 
     def brightness_set_cb(self, w, val):
         old_val = self._brightness
         pct = val / 100.0
         self.brightness = pct
-        self.pipeline.push(StageAction(self,
-                                       dict(brightness=old_val),
-                                       dict(brightness=self._brightness),
-                                       descr=f"rgbmap / brightness: {pct}"))
-
-        self.pipeline.run_from(self)
+        self._schedule_pending('brightness', old_val, self._brightness,
+                               f"rgbmap / brightness: {pct}")
 
     def restore_contrast_cb(self, w):
         self.contrast_set_cb(w, 50)
@@ -390,31 +537,89 @@ class RGBMap(Stage):
                                        descr="rgbmap / change calg"))
         self.calg_name = name
 
-        self.pipeline.run_from(self)
+        self._rerun()
 
     def copy_from_viewer_cb(self, w):
         rgbmap = self.viewer.get_rgbmap()
         rgbmap.copy_attributes(self.rgbmap, keylist=self.settings_keys)
 
-        self.pipeline.run_from(self)
+        self._rerun()
 
     def rgbmap_changed_cb(self, rgbmap):
-        self.fv.gui_do_oneshot('pl-rgbmap', self.pipeline.run_from, self)
+        self._bump()
+        if self._in_setter:
+            return
+        self.fv.gui_do_oneshot('pl-rgbmap', self._rerun)
 
     def run(self, prev_stage):
+        if self._bypass:
+            self.pipeline.send(res_np=self.pipeline.get_data(prev_stage))
+            return
+
         data = self.pipeline.get_data(prev_stage)
+        if data is None:
+            self.pipeline.send(res_np=None)
+            return
         self.verify_2d(data)
 
-        if self._bypass or data is None:
-            self.pipeline.send(res_np=data)
+        # if the previous stage has not run again since our last run
+        # (e.g. the pipeline is being rerun from this stage) and the
+        # mapping has not changed, then the last result is still good.
+        # NOTE: the previous stage's result is checked, rather than just
+        # the input array, because a stage may send the same array again
+        # with its contents changed (e.g. Input with an edited image)
+        src = prev_stage.result
+        key = self.get_output_signature(data)
+        if (src is self._last_src and key == self._last_key and
+            self._last_res is not None):
+            self.pipeline.send(res_np=self._last_res)
             return
 
-        if not np.issubdtype(data.dtype, np.uint):
-            data = data.astype(np.uint)
-
-        # get RGB mapped array
-        res_np = self.rgbmap.get_rgb_array(data, order=self.order)
-
+        if data.dtype.kind != 'u' or not np.can_cast(data.dtype, np.intp):
+            # cast to the narrowest unsigned type that can index the
+            # color hash table, clipping out of range values to the
+            # ends of the table rather than letting them wrap around.
+            # NOTE: uint64 is cast too, as numpy can't index with it
+            hashsize = self.rgbmap.get_hash_size()
+            if hashsize <= 65536:
+                dtype = np.dtype(np.uint16)
+            else:
+                dtype = np.dtype(np.uint32)
+            buf = self._cast_buf
+            if buf is None or buf.shape != data.shape or buf.dtype != dtype:
+                buf = np.empty(data.shape, dtype=dtype)
+                self._cast_buf = buf
+            np.clip(data, 0, hashsize - 1, out=buf, casting='unsafe')
+            data = buf
+
+        lut = self.rgbmap.get_rgb_lut()
+        if lut is not None and self.order == 'RGB' and len(data.shape) == 2:
+            # NOTE: a new output array is made each run, because later
+            # stages (e.g. the preview) may hold on to our result
+            apply_lut = None
+            if data.dtype in (np.uint8, np.uint16):
+                apply_lut = _get_lut_kernel()
+            if apply_lut is not None:
+                res_np = np.empty(data.shape + (3,), dtype=lut.dtype)
+                apply_lut(data, lut, res_np)
+            else:
+                # NOTE: mode='clip' clips the indexes to the table
+                res_np = np.take(lut, data, axis=0, mode='clip')
+
+        elif (lut is not None and self.order == 'RGB' and
+              len(data.shape) == 3 and data.shape[2] == 3):
+            # indexes already contain RGB info: map each channel through
+            # its own column of the table
+            res_np = np.empty(data.shape, dtype=lut.dtype)
+            for i in range(3):
+                np.take(lut[:, i], data[..., i], out=res_np[..., i],
+                        mode='clip')
+
+        else:
+            # get RGB mapped array
+            res_np = self.rgbmap.get_rgb_array(data, order=self.order)
+
+        self._last_key, self._last_src, self._last_res = key, src, res_np
         self.pipeline.send(res_np=res_np)
 
     def __str__(self):
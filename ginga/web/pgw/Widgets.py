@@ -641,6 +641,12 @@ class ComboBox(WidgetBase):
     def append_text(self, text):
         self.choices.append(text)
 
+    def append_texts(self, texts):
+        self.choices.extend(texts)
+        if self._rendered:
+            app = self.get_app()
+            app.do_operation('update_html', id=self.id, value=self.render())
+
     def set_index(self, index):
         self.index = index
         if self._rendered: